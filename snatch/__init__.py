@@ -4,61 +4,67 @@ snatch - Generate presentable images of code snippets from the terminal
 Uses Playwright (Chromium) for perfect HTML/CSS rendering
 """
 
+import io
+import os
+import hashlib
+import importlib.util
+import math
 import sys
+import json
 import argparse
 import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial
+from string import Template
 
-try:
-    from playwright.async_api import async_playwright
-except ImportError:
-    print("Error: playwright is not installed.", file=sys.stderr)
-    print("Install with:", file=sys.stderr)
-    print("  pip install playwright", file=sys.stderr)
-    print("  playwright install chromium", file=sys.stderr)
-    sys.exit(1)
+import base64
+from pathlib import Path
 
+# Only the light Pygments modules are imported up front (the custom style
+# needs them). Lexers, formatters and Playwright are imported on first use,
+# so --help and --list-themes don't pay for them.
 try:
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name, guess_lexer, get_lexer_for_filename
-    from pygments.formatters import HtmlFormatter
-    from pygments.styles import get_style_by_name, get_all_styles
+    from pygments.style import Style
+    from pygments.token import (
+        Comment,
+        Error,
+        Keyword,
+        Name,
+        Number,
+        Operator,
+        String,
+        Generic,
+        Literal,
+        Text,
+        Whitespace,
+        Token,
+    )
 except ImportError:
     print("Error: pygments is not installed.", file=sys.stderr)
     print("Install with: pip install pygments", file=sys.stderr)
     sys.exit(1)
 
 
-try:
-    import pyperclipimg
+def _import_playwright():
+    """Import Playwright on first render; it is by far the slowest import"""
+    try:
+        from playwright.async_api import async_playwright
+    except ImportError:
+        print("Error: playwright is not installed.", file=sys.stderr)
+        print("Install with:", file=sys.stderr)
+        print("  pip install playwright", file=sys.stderr)
+        print("  playwright install chromium", file=sys.stderr)
+        sys.exit(1)
+    return async_playwright
 
-    HAS_PYPERCLIPIMG = True
-except ImportError:
-    HAS_PYPERCLIPIMG = False
 
+_FONTS_DIR = Path(__file__).parent / "fonts"
 
-import base64
-from pathlib import Path
 
-# Load bundled Menlo font as base64 for embedding in HTML
-_FONTS_DIR = Path(__file__).parent / "fonts"
-_MENLO_REGULAR_B64 = base64.b64encode((_FONTS_DIR / "Menlo-Regular.ttf").read_bytes()).decode()
-_MENLO_BOLD_B64 = base64.b64encode((_FONTS_DIR / "Menlo-Bold.ttf").read_bytes()).decode()
-
-from pygments.style import Style
-from pygments.token import (
-    Comment,
-    Error,
-    Keyword,
-    Name,
-    Number,
-    Operator,
-    String,
-    Generic,
-    Literal,
-    Text,
-    Whitespace,
-    Token,
-)
+@lru_cache(maxsize=None)
+def _font_b64(name):
+    """Load a bundled Menlo font as base64 for embedding in HTML"""
+    return base64.b64encode((_FONTS_DIR / name).read_bytes()).decode()
 
 
 class MiasmaStyle(Style):
@@ -136,39 +142,147 @@ CUSTOM_STYLES = {"miasma": MiasmaStyle}
 
 def get_style_by_name_with_custom(name):
     """Get a Pygments style by name, including custom styles"""
+    from pygments.styles import get_style_by_name
+
     if name.lower() in CUSTOM_STYLES:
         return CUSTOM_STYLES[name.lower()]
     return get_style_by_name(name)
 
 
+@lru_cache(maxsize=32)
+def _style_obj(style):
+    """Cached style lookup; styles are resolved once per process"""
+    return get_style_by_name_with_custom(style)
+
+
+@lru_cache(maxsize=64)
+def _formatter_and_css(style, linenos, inline=False):
+    """Cached formatter and its stylesheet, which only depend on these
+
+    With `inline`, token styles are written onto each span and the
+    stylesheet keeps only the base rules (default text color, line
+    numbers) that Pygments doesn't inline.
+    """
+    from pygments.formatters import HtmlFormatter
+
+    formatter = HtmlFormatter(
+        style=_style_obj(style),
+        linenos="table" if linenos else False,
+        cssclass="highlight",
+        noclasses=inline,
+    )
+    css = formatter.get_style_defs(".highlight")
+    if inline:
+        css = "\n".join(
+            line for line in css.splitlines() if not line.startswith(".highlight .")
+        )
+    return formatter, css
+
+
 def get_all_styles_with_custom():
     """Get all available styles, including custom ones"""
+    from pygments.styles import get_all_styles
+
     pygments_styles = list(get_all_styles())
     custom_style_names = list(CUSTOM_STYLES.keys())
     return sorted(pygments_styles + custom_style_names)
 
 
-def copy_to_clipboard(image_data):
+def _write_temp_image(image_data, suffix):
+    """Dump image bytes to a fresh temporary file and return its path
+
+    Written straight to the descriptor, bypassing the buffered file object.
+    """
+    import tempfile
+
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        view = memoryview(image_data)
+        while view:
+            view = view[os.write(fd, view) :]
+    except BaseException:
+        os.close(fd)
+        os.unlink(path)
+        raise
+    os.close(fd)
+    return path
+
+
+def _copy_windows_dib(image_data):
+    """Put an image on the Windows clipboard in-process as a DIB
+
+    Needs pywin32 and Pillow; raises ImportError without them.
+    """
+    import win32clipboard
+    from PIL import Image
+
+    if not isinstance(image_data, bytes):
+        image_data = Path(image_data).read_bytes()
+
+    # A DIB is a BMP without its 14-byte file header
+    bmp = io.BytesIO()
+    Image.open(io.BytesIO(image_data)).convert("RGB").save(bmp, "BMP")
+    dib = bmp.getvalue()[14:]
+
+    win32clipboard.OpenClipboard()
+    try:
+        win32clipboard.EmptyClipboard()
+        win32clipboard.SetClipboardData(win32clipboard.CF_DIB, dib)
+    finally:
+        win32clipboard.CloseClipboard()
+
+
+def copy_to_clipboard(image_data, image_format="png"):
     """Copy image to clipboard (cross-platform)
 
     Args:
         image_data: Either a file path (str) or image bytes (bytes)
+        image_format: "png" or "jpeg"
     """
     import platform
     import subprocess
-    import os
-    import tempfile
+
+    try:
+        import pyperclipimg
+    except ImportError:
+        pyperclipimg = None
 
     is_bytes = isinstance(image_data, bytes)
+    suffix = ".jpg" if image_format == "jpeg" else ".png"
+    mime_type = f"image/{image_format}"
+    system = platform.system()
+
+    # On Linux, bytes can go straight to xclip's stdin; pyperclipimg would
+    # need them written to a temporary file first
+    xclip_error = None
+    if is_bytes and system == "Linux":
+        try:
+            subprocess.run(
+                ["xclip", "-selection", "clipboard", "-t", mime_type, "-i"],
+                input=image_data,
+                check=True,
+            )
+            return True
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            xclip_error = e
+
+    # On Windows, set the clipboard in-process rather than paying for a
+    # PowerShell start-up and .NET assembly loads
+    if system == "Windows":
+        try:
+            _copy_windows_dib(image_data)
+            return True
+        except ImportError:
+            pass
+        except Exception as e:
+            print(f"win32clipboard failed: {e}, trying fallback...", file=sys.stderr)
 
     # Try pyperclipimg first if available
-    if HAS_PYPERCLIPIMG:
+    if pyperclipimg:
         try:
             if is_bytes:
                 # Write to temporary file for pyperclipimg
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                    tmp.write(image_data)
-                    tmp_path = tmp.name
+                tmp_path = _write_temp_image(image_data, suffix)
                 try:
                     pyperclipimg.copy(tmp_path)
                     return True
@@ -181,51 +295,37 @@ def copy_to_clipboard(image_data):
             print(f"pyperclipimg failed: {e}, trying fallback...", file=sys.stderr)
 
     # Fallback to platform-specific commands
-    system = platform.system()
+
+    # Bytes on Linux already went through the xclip pipe above; running it
+    # again would only fail the same way
+    if xclip_error:
+        print(f"Clipboard error: {xclip_error}", file=sys.stderr)
+        return False
 
     # For bytes, we need to write to a temp file for most methods
     temp_file_created = False
     if is_bytes:
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            tmp.write(image_data)
-            image_path = tmp.name
-            temp_file_created = True
+        image_path = _write_temp_image(image_data, suffix)
+        temp_file_created = True
     else:
         image_path = os.path.abspath(image_data)
 
     try:
         if system == "Darwin":  # macOS
+            image_class = "JPEG" if image_format == "jpeg" else "PNGf"
             subprocess.run(
                 [
                     "osascript",
                     "-e",
-                    f'set the clipboard to (read (POSIX file "{image_path}") as «class PNGf»)',
+                    f'set the clipboard to (read (POSIX file "{image_path}") as «class {image_class}»)',
                 ],
                 check=True,
             )
         elif system == "Linux":
-            # xclip can read from stdin, which is perfect for bytes
-            if is_bytes:
-                process = subprocess.Popen(
-                    ["xclip", "-selection", "clipboard", "-t", "image/png", "-i"],
-                    stdin=subprocess.PIPE,
-                )
-                process.communicate(input=image_data)
-                if process.returncode != 0:
-                    raise subprocess.CalledProcessError(process.returncode, "xclip")
-            else:
-                subprocess.run(
-                    [
-                        "xclip",
-                        "-selection",
-                        "clipboard",
-                        "-t",
-                        "image/png",
-                        "-i",
-                        image_path,
-                    ],
-                    check=True,
-                )
+            subprocess.run(
+                ["xclip", "-selection", "clipboard", "-t", mime_type, "-i", image_path],
+                check=True,
+            )
         elif system == "Windows":
             ps_script = f"""
             Add-Type -AssemblyName System.Windows.Forms
@@ -250,36 +350,39 @@ def copy_to_clipboard(image_data):
                 pass
 
 
+# Colors are blended as packed 0xRRGGBB integers: red and blue share one
+# word with a spare byte above each lane for the 8.8 fixed-point products,
+# green is handled on its own. One parse and one format per call.
+_RB_MASK = 0xFF00FF
+_G_MASK = 0x00FF00
+
+
+@lru_cache(maxsize=256)
 def lighten_color(hex_color, amount=0.2):
     """Lighten a hex color by a given amount"""
-    # Remove '#' if present
-    hex_color = hex_color.lstrip("#")
+    v = int(hex_color.lstrip("#"), 16)
+    a = round(amount * 256)
 
-    # Convert to RGB
-    r, g, b = int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16)
+    # Move each channel towards 255: c + (255 - c) * amount
+    rb = v & _RB_MASK
+    g = v & _G_MASK
+    rb = (rb + (((_RB_MASK - rb) * a) >> 8)) & _RB_MASK
+    g = (g + (((_G_MASK - g) * a) >> 8)) & _G_MASK
 
-    # Lighten
-    r = min(255, int(r + (255 - r) * amount))
-    g = min(255, int(g + (255 - g) * amount))
-    b = min(255, int(b + (255 - b) * amount))
-
-    return f"#{r:02x}{g:02x}{b:02x}"
+    return f"#{rb | g:06x}"
 
 
+@lru_cache(maxsize=256)
 def darken_color(hex_color, amount=0.3):
     """Darken a hex color by a given amount"""
-    # Remove '#' if present
-    hex_color = hex_color.lstrip("#")
-
-    # Convert to RGB
-    r, g, b = int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16)
+    v = int(hex_color.lstrip("#"), 16)
+    keep = round((1 - amount) * 256)
 
-    # Darken
-    r = max(0, int(r * (1 - amount)))
-    g = max(0, int(g * (1 - amount)))
-    b = max(0, int(b * (1 - amount)))
+    # Scale each channel: c * (1 - amount)
+    rb = (((v & _RB_MASK) * keep) >> 8) & _RB_MASK
+    g = (((v & _G_MASK) * keep) >> 8) & _G_MASK
 
-    return f"#{r:02x}{g:02x}{b:02x}"
+    return f"#{rb | g:06x}"
 
 
 HTML_TEMPLATE = """
@@ -288,72 +391,78 @@ HTML_TEMPLATE = """
 <head>
     <meta charset="UTF-8">
     <style>
-        @font-face {{
+        @font-face {
             font-family: 'SnatchMenlo';
             font-weight: normal;
-            src: url(data:font/truetype;base64,{menlo_regular_b64}) format('truetype');
-        }}
-        @font-face {{
+            src: url(data:font/truetype;base64,$menlo_regular_b64) format('truetype');
+        }
+        @font-face {
             font-family: 'SnatchMenlo';
             font-weight: bold;
-            src: url(data:font/truetype;base64,{menlo_bold_b64}) format('truetype');
-        }}
+            src: url(data:font/truetype;base64,$menlo_bold_b64) format('truetype');
+        }
 
-        * {{
+        * {
             margin: 0;
             padding: 0;
             box-sizing: border-box;
-        }}
+        }
+
+        /* Nothing moves; keep the compositor from scheduling frames for it */
+        *, *::before, *::after {
+            animation: none !important;
+            transition: none !important;
+        }
         
-        body {{
-            background: radial-gradient(ellipse at center, {gradient_start} 0%, {gradient_end} 100%);
-            padding: {margin}px;
+        body {
+            background: radial-gradient(ellipse at center, $gradient_start 0%, $gradient_end 100%);
+            padding: ${margin}px;
             display: inline-block;
             -webkit-font-smoothing: antialiased;
-        }}
+        }
         
-        .window {{
-            background: {bg_color};
+        .window {
+            background: $bg_color;
             border-radius: 8px;
             overflow: hidden;
             display: inline-block;
             box-shadow: 0 20px 68px rgba(0, 0, 0, 0.55);
-        }}
+        }
         
-        .window-header-chrome {{
-            background: {window};
+        .window-header-chrome {
+            background: $window;
             height: 35px;
             display: flex;
             align-items: center;
             padding-left: 12px;
             gap: 6px;
-        }}
+        }
 
-        .window-header-clear {{
-            background: {bg_color};
+        .window-header-clear {
+            background: $bg_color;
             height: 35px;
             display: flex;
             align-items: center;
             padding-left: 12px;
             gap: 6px;
             margin-bottom: -0.5em;
-        }}
+        }
         
-        .window-button {{
+        .window-button {
             width: 10px;
             height: 10px;
             border-radius: 50%;
-        }}
+        }
         
-        .window-button.red {{ background: #ff5f56; }}
-        .window-button.yellow {{ background: #ffbd2e; }}
-        .window-button.green {{ background: #27c93f; }}
+        .window-button.red { background: #ff5f56; }
+        .window-button.yellow { background: #ffbd2e; }
+        .window-button.green { background: #27c93f; }
         
-        .code-container {{
-            background: {bg_color};
-            padding: {padding}px;
+        .code-container {
+            background: $bg_color;
+            padding: ${padding}px;
             font-family: 'SnatchMenlo', monospace;
-            font-size: {font_size}px;
+            font-size: ${font_size}px;
             line-height: 1.5;
             overflow-x: auto;
 
@@ -363,93 +472,190 @@ HTML_TEMPLATE = """
             text-rendering: geometricPrecision;
             font-smooth: never;
             image-rendering: crisp-edges;
-        }}
+        }
         
-        .highlight pre {{
+        .highlight pre {
             margin: 0;
             padding: 0;
             font-family: inherit;
-        }}
+        }
         
         /* Aggressively override ALL backgrounds to match */
         .highlight,
         .highlight *,
         .highlighttable,
-        .highlighttable * {{
-            background-color: {bg_color} !important;
-            background: {bg_color} !important;
+        .highlighttable * {
+            background-color: $bg_color !important;
+            background: $bg_color !important;
             border: none !important;
-        }}
+        }
         
-        .highlight .linenos {{
+        .highlight .linenos {
             padding-right: 0.5em !important;
             user-select: none;
             text-align: right;
-        }}
+        }
         
-        {pygments_css}
+        $pygments_css
+
+        $layout_css
     </style>
 </head>
 <body>
     <div class="window">
-        {window_header}
+        $window_header
         <div class="code-container">
-            {highlighted_code}
+            $highlighted_code
         </div>
     </div>
 </body>
 </html>
 """
 
+# Parsed once at import; renders only substitute. Split around the code so
+# Pygments can write straight into the document buffer.
+_head, _TEMPLATE_TAIL = HTML_TEMPLATE.split("$highlighted_code")
+_TEMPLATE_HEAD = Template(_head)
 
-async def create_code_image(
+# Window header HTML keyed by (show_window, show_decorations)
+_WINDOW_HEADERS = {
+    (True, True): """
+        <div class="window-header-chrome">
+            <div class="window-button red"></div>
+            <div class="window-button yellow"></div>
+            <div class="window-button green"></div>
+        </div>
+        """,
+    (True, False): """
+        <div class="window-header-chrome"></div>
+        """,
+    (False, True): """
+        <div class="window-header-clear">
+            <div class="window-button red"></div>
+            <div class="window-button yellow"></div>
+            <div class="window-button green"></div>
+        </div>
+        """,
+    (False, False): "",
+}
+
+
+# How much of the input guess_lexer() gets to look at
+GUESS_LEXER_CHARS = 4096
+
+# Snippets shorter than this carry their token styles inline, which spares
+# Chromium matching a stylesheet of every token class. Past it, the
+# repeated style attributes cost more to parse than the selectors save.
+INLINE_STYLES_CHARS = 8000
+
+# Inputs longer than this are rendered as plain text; regex lexing them
+# would stall for seconds
+MAX_HIGHLIGHT_CHARS = 1_000_000
+
+
+@lru_cache(maxsize=64)
+def _lexer_by_name(name):
+    """Cached lexer lookup by language name, None if unknown"""
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        return get_lexer_by_name(name)
+    except ClassNotFound:
+        return None
+
+
+@lru_cache(maxsize=128)
+def _lexer_for_filename(name):
+    """Cached lexer lookup by file name, None if no lexer claims it
+
+    Keyed on the whole base name rather than the extension, since some
+    patterns match full names (Makefile, CMakeLists.txt).
+    """
+    from pygments.lexers import get_lexer_for_filename
+    from pygments.util import ClassNotFound
+
+    try:
+        return get_lexer_for_filename(name)
+    except ClassNotFound:
+        return None
+
+
+def _max_width_css(max_width):
+    """Cap the image width; lines too long to fit are clipped"""
+    if not max_width:
+        return ""
+    return f"body {{ max-width: {max_width}px; }} .window {{ max-width: 100%; }}"
+
+
+def _flat_css(background):
+    """Solid backdrop and a tight shadow, cheap to rasterize at high scales"""
+    return (
+        f"body {{ background: {background}; }} "
+        ".window { box-shadow: 0 2px 8px rgba(0, 0, 0, 0.3); }"
+    )
+
+
+def _warn(message):
+    print(f"Warning: {message}", file=sys.stderr)
+
+
+def build_html(
     code,
     style="monokai",
     font_size=14,
     padding=40,
     show_line_numbers=True,
-    output=None,  # Changed to None
     show_window=True,
     show_decorations=True,
     language=None,
     filename=None,
     margin=60,
+    max_width=None,
+    fast=False,
+    warn=_warn,
 ):
-    """Generate an image from code using Playwright (Chromium) rendering"""
+    """Generate the self-contained HTML document for a code snippet
+
+    `fast` trades the gradient backdrop and wide soft shadow, the costliest
+    things for Chromium to paint, for flat equivalents. Fallbacks (unknown
+    language or style, oversized input) are reported through `warn`,
+    which prints to stderr by default.
+    """
+    from pygments.lexers import guess_lexer
+    from pygments.util import ClassNotFound
 
     # Determine lexer for syntax highlighting
     lexer = None
-    if language:
-        try:
-            lexer = get_lexer_by_name(language)
-        except:
-            print(
-                f"Warning: Unknown language '{language}', falling back to auto-detection",
-                file=sys.stderr,
-            )
+    if len(code) > MAX_HIGHLIGHT_CHARS:
+        warn(
+            f"Input is over {MAX_HIGHLIGHT_CHARS:,} characters, "
+            "rendering it without syntax highlighting"
+        )
+        lexer = _lexer_by_name("text")
+    elif language:
+        lexer = _lexer_by_name(language)
+        if not lexer:
+            warn(f"Unknown language '{language}', falling back to auto-detection")
 
     if not lexer and filename:
-        try:
-            lexer = get_lexer_for_filename(filename)
-        except:
-            pass
+        lexer = _lexer_for_filename(Path(filename).name)
 
     if not lexer:
+        # Guessing runs every lexer's analyse_text over its input; the head of
+        # the file is plenty to go on and keeps large files from stalling
         try:
-            lexer = guess_lexer(code)
-        except:
-            lexer = get_lexer_by_name("text")
+            lexer = guess_lexer(code[:GUESS_LEXER_CHARS])
+        except ClassNotFound:
+            lexer = _lexer_by_name("text")
 
     # Get Pygments style and extract background color
     try:
-        pygments_style_obj = get_style_by_name_with_custom(style)
+        pygments_style_obj = _style_obj(style)
     except:
-        print(
-            f"Warning: Unknown style '{style}', falling back to 'monokai'",
-            file=sys.stderr,
-        )
+        warn(f"Unknown style '{style}', falling back to 'monokai'")
         style = "monokai"
-        pygments_style_obj = get_style_by_name(style)
+        pygments_style_obj = _style_obj(style)
 
     bg_color = pygments_style_obj.background_color
 
@@ -458,42 +664,13 @@ async def create_code_image(
     gradient_start = lighten_color(bg_color, 0.05)
     gradient_end = darken_color(bg_color, 0.25)
 
-    # Generate highlighted HTML
-    formatter = HtmlFormatter(
-        style=pygments_style_obj,
-        linenos="table" if show_line_numbers else False,
-        cssclass="highlight",
-        noclasses=False,
+    formatter, pygments_css = _formatter_and_css(
+        style, show_line_numbers, inline=len(code) < INLINE_STYLES_CHARS
     )
-    highlighted_code = highlight(code, lexer, formatter)
-    pygments_css = formatter.get_style_defs(".highlight")
 
-    # Generate window header HTML
-    if show_window and show_decorations:
-        window_header = """
-        <div class="window-header-chrome">
-            <div class="window-button red"></div>
-            <div class="window-button yellow"></div>
-            <div class="window-button green"></div>
-        </div>
-        """
-    elif show_window and not show_decorations:
-        window_header = """
-        <div class="window-header-chrome"></div>
-        """
-    elif not show_window and show_decorations:
-        window_header = """
-        <div class="window-header-clear">
-            <div class="window-button red"></div>
-            <div class="window-button yellow"></div>
-            <div class="window-button green"></div>
-        </div>
-        """
-    else:
-        window_header = ""
-
-    # Generate full HTML
-    html = HTML_TEMPLATE.format(
+    # Generate full HTML, streaming the highlighted code into place rather
+    # than building it as a separate string first
+    head = _TEMPLATE_HEAD.substitute(
         bg_color=bg_color,
         window=window_color,
         gradient_start=gradient_start,
@@ -501,38 +678,808 @@ async def create_code_image(
         font_size=font_size,
         padding=padding,
         margin=margin,
-        window_header=window_header,
-        highlighted_code=highlighted_code,
+        window_header=_WINDOW_HEADERS[bool(show_window), bool(show_decorations)],
         pygments_css=pygments_css,
-        menlo_regular_b64=_MENLO_REGULAR_B64,
-        menlo_bold_b64=_MENLO_BOLD_B64,
-    )
-
-    # Use Playwright to render HTML to image
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page(
-            device_scale_factor=3
-        )  # 2x for retina, 3x for extra sharp
-        await page.set_content(html)
-
-        # Get the element and take a screenshot
-        element = await page.query_selector("body")
-
-        if output:
-            # Save to file
-            await element.screenshot(path=output)
-            print(f"Image saved to {output}")
-            screenshot_bytes = None
-        else:
-            # Return bytes for clipboard
-            screenshot_bytes = await element.screenshot()
+        layout_css=_max_width_css(max_width)
+        + (_flat_css(gradient_end) if fast else ""),
+        menlo_regular_b64=_font_b64("Menlo-Regular.ttf"),
+        menlo_bold_b64=_font_b64("Menlo-Bold.ttf"),
+    )
+    html = io.StringIO()
+    html.write(head)
+    formatter.format(lexer.get_tokens(code), html)
+    html.write(_TEMPLATE_TAIL)
+    return html.getvalue()
+
+
+# Playwright already disables extensions, background networking, default
+# apps, first-run UI and the like; these are on top of its defaults
+LAUNCH_ARGS = ["--no-sandbox", "--disable-dev-shm-usage", "--disable-sync"]
+
+# Hardware-accelerated compositing. Opt-in: ANGLE has been seen to leak
+# memory in long-running headless sessions.
+GPU_LAUNCH_ARGS = ["--use-gl=angle", "--enable-gpu-rasterization", "--enable-zero-copy"]
+
+# Without --gpu, skip bringing up the GPU process at all; the page is
+# rasterized in software either way
+NO_GPU_LAUNCH_ARGS = ["--disable-gpu"]
+
+
+def launch_options(gpu=False):
+    """Keyword arguments for chromium.launch()"""
+    args = LAUNCH_ARGS + (GPU_LAUNCH_ARGS if gpu else NO_GPU_LAUNCH_ARGS)
+    return {"headless": True, "args": args}
+
+
+# The embedded fonts load asynchronously even after the DOM is ready, so
+# wait for them before measuring (and therefore before capturing)
+_MEASURE_BODY_JS = """async () => {
+    await document.fonts.ready;
+    const r = document.body.getBoundingClientRect();
+    return [r.x, r.y, r.width, r.height];
+}"""
+
+
+class PagePool:
+    """Recycle pages across renders instead of creating one per capture
+
+    device_scale_factor is fixed when a context is created, so the pool keeps
+    one context per scale with up to `size` pages in each. Released pages are
+    navigated to about:blank and handed to the next render, together with
+    their DevTools session.
+    """
+
+    def __init__(self, browser, size=None):
+        self.browser = browser
+        self.size = size or os.cpu_count() or 1
+        self._lock = asyncio.Lock()
+        self._contexts = {}
+        self._slots = {}
+        self._idle = {}
+        self._sessions = {}
+
+    async def _context(self, scale):
+        async with self._lock:
+            if scale not in self._contexts:
+                context = await self.browser.new_context(
+                    device_scale_factor=scale, reduced_motion="reduce"
+                )
+                # Documents are self-contained; nothing should hit the network
+                await context.route("**/*", lambda route: route.abort())
+                self._contexts[scale] = context
+                self._slots[scale] = asyncio.Semaphore(self.size)
+                self._idle[scale] = []
+            return self._contexts[scale]
+
+    @asynccontextmanager
+    async def acquire(self, scale=2):
+        context = await self._context(scale)
+        idle = self._idle[scale]
+        async with self._slots[scale]:
+            page = idle.pop() if idle else await context.new_page()
+            try:
+                yield page
+            except BaseException:
+                # Don't hand a page in an unknown state to the next render
+                await self._discard(page)
+                raise
+            # The render is done; a page that can't be reset (e.g. it
+            # crashed) is dropped rather than failing the capture
+            try:
+                await page.goto("about:blank")
+            except Exception:
+                await self._discard(page)
+            else:
+                idle.append(page)
+
+    async def _discard(self, page):
+        self._sessions.pop(page, None)
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+    async def session(self, page):
+        """The page's DevTools session, opened on first use and then reused"""
+        if page not in self._sessions:
+            self._sessions[page] = await page.context.new_cdp_session(page)
+        return self._sessions[page]
+
+    async def close(self):
+        for context in self._contexts.values():
+            await context.close()
+        self._contexts.clear()
+        self._slots.clear()
+        self._idle.clear()
+        self._sessions.clear()
+
+
+def image_format_for(path):
+    """Guess the image format from an output file extension"""
+    if path and Path(path).suffix.lower() in (".jpg", ".jpeg"):
+        return "jpeg"
+    return "png"
+
+
+def has_pillow():
+    """Whether Pillow is available for --fast-png"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def _reencode_png(data):
+    """Re-encode an intermediate WebP capture as a lightly compressed PNG"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        out = io.BytesIO()
+        image.save(out, "PNG", compress_level=1)
+    return out.getvalue()
+
+
+def can_quantize():
+    """Whether pngquant or Pillow is available for --quantize"""
+    import shutil
+
+    return shutil.which("pngquant") is not None or has_pillow()
+
+
+def quantize_png(data):
+    """Reduce a PNG to an 8-bit palette, preferring pngquant over Pillow
+
+    Code screenshots only use a handful of colors, so this typically shrinks
+    them several times over. Returns the input unchanged if pngquant can't
+    meet its quality floor or neither tool is available.
+    """
+    import shutil
+    import subprocess
+
+    pngquant = shutil.which("pngquant")
+    if pngquant:
+        result = subprocess.run(
+            [pngquant, "--speed", "1", "--quality=90-100", "-"],
+            input=data,
+            capture_output=True,
+        )
+        # Exit code 99 means the result would fall below the quality floor
+        return result.stdout if result.returncode == 0 else data
+
+    if has_pillow():
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as image:
+            out = io.BytesIO()
+            image.quantize(256, dither=Image.Dither.NONE).save(out, "PNG")
+        return out.getvalue()
+
+    return data
+
+
+async def capture(
+    pool,
+    html,
+    output=None,
+    scale=2,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+):
+    """Screenshot rendered HTML using a page from the pool
+
+    Args:
+        pool: A PagePool wrapping a launched Playwright Chromium browser
+        html: The document produced by build_html()
+        output: File path to also save the image to, or None
+        scale: Device scale factor (2x for retina, 3x for extra sharp, 1x fastest)
+        image_format: "png", or "jpeg" which encodes several times faster
+        quality: JPEG quality (0-100), ignored for PNG
+        fast_png: Have Chromium encode WebP, which is much quicker than its
+            PNG encoder, and convert to PNG with Pillow on a worker thread.
+            Lossy; needs Pillow.
+        quantize: Convert PNGs to an 8-bit palette (see quantize_png)
+
+    Returns:
+        The image bytes
+    """
+    # The format Chromium encodes; may differ from the one written out
+    capture_format = "webp" if fast_png and image_format == "png" else image_format
+
+    async with pool.acquire(scale=scale) as page:
+        # Everything is inline, so the page is ready once the DOM is parsed
+        await page.set_content(html, wait_until="domcontentloaded")
+
+        # The inline-block body is the whole image. Fit the viewport to it and
+        # capture straight through DevTools, skipping the element lookup,
+        # scroll-into-view and clip bookkeeping of Playwright's screenshot().
+        x, y, width, height = await page.evaluate(_MEASURE_BODY_JS)
+        await page.set_viewport_size(
+            {"width": math.ceil(x + width), "height": math.ceil(y + height)}
+        )
+        params = {
+            "format": capture_format,
+            "clip": {"x": x, "y": y, "width": width, "height": height, "scale": 1},
+            "captureBeyondViewport": False,
+            "optimizeForSpeed": True,
+        }
+        if capture_format == "webp":
+            params["quality"] = 100
+        elif image_format == "jpeg" and quality is not None:
+            params["quality"] = quality
+
+        cdp = await pool.session(page)
+        result = await cdp.send("Page.captureScreenshot", params)
+
+    data = base64.b64decode(result["data"])
+    if capture_format != image_format:
+        data = await asyncio.to_thread(_reencode_png, data)
+    if quantize and image_format == "png":
+        data = await asyncio.to_thread(quantize_png, data)
+
+    if output:
+        # Save to file on a worker thread, so concurrent renders keep
+        # talking to the browser while this one hits the disk
+        await asyncio.to_thread(Path(output).write_bytes, data)
+    return data
+
+
+# Process-wide Playwright state, shared by every render on the running loop
+_MANAGER = None
+_PLAYWRIGHT = None
+_BROWSER = None
+_POOL = None
+_LOOP = None
+_LOCK = None
+# Open browser_session() blocks on the running loop
+_HOLDS = 0
+
+
+def _kill_stale_driver():
+    """Kill a Playwright driver left running by an event loop that has ended
+
+    Its objects can't be awaited from another loop, so this goes straight
+    for the driver process; Chromium exits along with it. Best effort, as
+    the process handle is not public API.
+    """
+    connection = getattr(_MANAGER, "_connection", None)
+    proc = getattr(getattr(connection, "_transport", None), "_proc", None)
+    if proc is not None and proc.returncode is None:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+
+async def get_pool(gpu=False, size=None):
+    """The shared page pool, launching Chromium on first use
+
+    The browser stays up across renders until shutdown() is awaited, or
+    the outermost browser_session() exits; `gpu` and `size` only apply to
+    the launch. Playwright objects are bound to the event loop they were
+    created on, so a new loop (another asyncio.run) gets a browser of its
+    own, and one left behind by a finished loop is killed.
+    """
+    global _MANAGER, _PLAYWRIGHT, _BROWSER, _POOL, _LOOP, _LOCK, _HOLDS
+
+    loop = asyncio.get_running_loop()
+    if _LOOP is not loop:
+        if _PLAYWRIGHT is not None:
+            _kill_stale_driver()
+        _MANAGER = _PLAYWRIGHT = _BROWSER = _POOL = None
+        _LOOP, _LOCK, _HOLDS = loop, asyncio.Lock(), 0
+
+    async with _LOCK:
+        if _POOL is None:
+            # After a crash, the driver is still up and only Chromium is gone
+            if _PLAYWRIGHT is None:
+                async_playwright = _import_playwright()
+                _MANAGER = async_playwright()
+                _PLAYWRIGHT = await _MANAGER.start()
+            try:
+                browser = await _PLAYWRIGHT.chromium.launch(**launch_options(gpu))
+            except BaseException:
+                playwright, _MANAGER, _PLAYWRIGHT = _PLAYWRIGHT, None, None
+                await playwright.stop()
+                raise
+            browser.on("disconnected", _forget_browser)
+            _BROWSER = browser
+            _POOL = PagePool(browser, size=size)
+    return _POOL
+
+
+def _forget_browser(browser):
+    """Drop a browser that went away (e.g. crashed) so the next get_pool()
+    launches a fresh one; a deliberate shutdown() has already let go of it
+    """
+    global _BROWSER, _POOL
+
+    if browser is _BROWSER:
+        _BROWSER = _POOL = None
+
 
-        await browser.close()
+@asynccontextmanager
+async def browser_session(gpu=False, size=None):
+    """Keep the shared browser up for the block, then close it
+
+    Sessions nest and may overlap; the browser is closed when the last one
+    exits. Wrap a series of create_code_image() calls in one to launch
+    Chromium only once:
+
+        async with snatch.browser_session():
+            for code, path in snippets:
+                await snatch.create_code_image(code, output=path)
+    """
+    global _HOLDS
+
+    pool = await get_pool(gpu=gpu, size=size)
+    _HOLDS += 1
+    try:
+        yield pool
+    finally:
+        _HOLDS -= 1
+        if not _HOLDS:
+            await shutdown()
+
+
+async def shutdown():
+    """Close the shared browser and stop Playwright, if running on this loop"""
+    global _MANAGER, _PLAYWRIGHT, _BROWSER, _POOL
+
+    if _LOOP is not asyncio.get_running_loop() or _PLAYWRIGHT is None:
+        return
+    pool, browser, playwright = _POOL, _BROWSER, _PLAYWRIGHT
+    _MANAGER = _PLAYWRIGHT = _BROWSER = _POOL = None
+    try:
+        if pool:
+            await pool.close()
+            await browser.close()
+    finally:
+        await playwright.stop()
+
+
+async def render_inline(
+    html,
+    output=None,
+    scale=2,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+    gpu=False,
+):
+    """Capture the HTML in-process with the shared browser (see get_pool)"""
+    pool = await get_pool(gpu=gpu)
+    return await capture(
+        pool,
+        html,
+        output=output,
+        scale=scale,
+        image_format=image_format,
+        quality=quality,
+        fast_png=fast_png,
+        quantize=quantize,
+    )
+
+
+async def batch_render(items, concurrency=50, gpu=False):
+    """Render many snippets concurrently against the shared browser
+
+    Args:
+        items: Dicts with `code` and `output` keys, plus any build_html()
+            keyword arguments and optional `scale`, `format`, `quality`,
+            `fast_png` and `quantize`
+        concurrency: Maximum number of snippets rendering at once
+        gpu: Launch Chromium with GPU compositing (see launch_options)
+
+    Returns:
+        One entry per item: None on success, or the exception that failed it
+    """
+    sem = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    # Highlighting is CPU-bound pure Python. With several snippets, run it in
+    # worker processes so it proceeds in parallel and overlaps with the
+    # captures of the snippets ahead of it.
+    executor = None
+    if len(items) > 1 and (os.cpu_count() or 1) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(min(len(items), os.cpu_count()))
+
+    async def bounded(pool, item):
+        item = dict(item)
+        output = item.pop("output")
+        scale = item.pop("scale", 2)
+        image_format = item.pop("format", None) or image_format_for(output)
+        quality = item.pop("quality", None)
+        fast_png = item.pop("fast_png", False)
+        quantize = item.pop("quantize", False)
+        async with sem:
+            if executor:
+                html = await loop.run_in_executor(executor, partial(build_html, **item))
+            else:
+                html = build_html(**item)
+            await capture(
+                pool,
+                html,
+                output=output,
+                scale=scale,
+                image_format=image_format,
+                quality=quality,
+                fast_png=fast_png,
+                quantize=quantize,
+            )
+
+    try:
+        pool = await get_pool(gpu=gpu, size=concurrency)
+        return await asyncio.gather(
+            *[bounded(pool, item) for item in items], return_exceptions=True
+        )
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+
+async def _batch_then_shutdown(items, concurrency=50, gpu=False):
+    async with browser_session(gpu=gpu, size=concurrency):
+        return await batch_render(items, concurrency=concurrency, gpu=gpu)
+
+
+def load_manifest(source):
+    """Read batch items from a JSON array or JSONL file ('-' for stdin)
+
+    Items may give a `file` instead of inline `code`; it is read here and
+    also used for lexer detection.
+    """
+    if source == "-":
+        text = sys.stdin.read()
+    else:
+        with open(source, "r") as f:
+            text = f.read()
+
+    if text.lstrip().startswith("["):
+        items = json.loads(text)
+    else:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for item in items:
+        if not isinstance(item, dict) or "output" not in item:
+            raise ValueError(f"every item needs an 'output': {item!r}")
+        if "code" not in item:
+            if "file" not in item:
+                raise ValueError(f"item needs 'code' or 'file': {item!r}")
+            path = item.pop("file")
+            with open(path, "r") as f:
+                item["code"] = f.read()
+            item.setdefault("filename", path)
+    return items
+
+
+# Least recently used images are evicted past this total size
+CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+
+def cache_dir():
+    """Where rendered images are cached, following $XDG_CACHE_HOME"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "snatch")
+
+
+@lru_cache(maxsize=None)
+def _browser_version():
+    """Identifies the Chromium build that rasterizes the HTML, for cache keys
+
+    Each Playwright release pins its own Chromium, whose output may differ.
+    """
+    import importlib.metadata
+
+    try:
+        return importlib.metadata.version("playwright")
+    except importlib.metadata.PackageNotFoundError:
+        return ""
+
+
+@lru_cache(maxsize=None)
+def _render_version():
+    """Identifies the code that turns a snippet into an image, for cache keys
+
+    Snippet keys hash the inputs rather than the HTML, so a Pygments
+    upgrade or a change to snatch itself has to invalidate them.
+    """
+    import pygments
+
+    source = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+    return f"{pygments.__version__}:{source}:{_browser_version()}"
+
+
+def _cache_path(digest, image_format, options):
+    digest.update(repr(sorted(options.items())).encode())
+    suffix = ".jpg" if image_format == "jpeg" else ".png"
+    return os.path.join(cache_dir(), digest.hexdigest() + suffix)
+
+
+def _cache_store(path, data, warnings=()):
+    """Write a cache entry atomically; a failed write only costs the cache
+
+    `warnings` are kept next to the image, to be replayed on a hit.
+    """
+    import tempfile
+
+    files = [(path, data)]
+    if warnings:
+        # Written after the image, so LRU trimming never drops it first
+        files.append((path + ".warnings", json.dumps(list(warnings)).encode()))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for file_path, content in files:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+    except OSError as e:
+        print(f"Warning: Could not write render cache: {e}", file=sys.stderr)
+        return
+    _cache_trim(os.path.dirname(path))
+
+
+def _cache_trim(directory, max_bytes=CACHE_MAX_BYTES):
+    """Delete the least recently used entries until the cache fits
+
+    Hits refresh an entry's mtime, so mtime order is use order.
+    """
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _cached_render(path, output, render):
+    """Serve `render()` from the cache entry at `path`, if any, filling it
+    on a miss; writes `output` and returns the bytes either way
+
+    `render()` returns the image bytes and the warnings it reported, which
+    a hit reports again.
+    """
+    data = None
+    if path:
+        try:
+            data = Path(path).read_bytes()
+            os.utime(path)
+        except OSError:
+            pass
+
+    if data is not None:
+        try:
+            warnings = json.loads(Path(path + ".warnings").read_bytes())
+            os.utime(path + ".warnings")
+        except (OSError, ValueError):
+            warnings = []
+        for message in warnings:
+            _warn(message)
+    else:
+        data, warnings = render()
+        if path:
+            _cache_store(path, data, warnings)
+
+    if output:
+        Path(output).write_bytes(data)
+    return data
+
+
+def _render_in_process(html, gpu=False, **options):
+    async def render_once():
+        async with browser_session(gpu=gpu):
+            return await render_inline(html, gpu=gpu, **options)
+
+    return asyncio.run(render_once())
+
+
+def render_html(
+    html,
+    output=None,
+    scale=2,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+    use_daemon=True,
+    gpu=False,
+    use_cache=True,
+    socket_path=None,
+):
+    """Render HTML to an image, preferring a warm background daemon
+
+    If no daemon is listening one is started for subsequent invocations,
+    and this render falls back to a one-off browser. `gpu` only takes
+    effect when a browser is launched, i.e. not for an already running
+    daemon. `socket_path` overrides the daemon's default socket. With
+    `use_cache`, identical renders are served from cache_dir() without
+    touching Chromium.
+
+    Returns the image bytes, which are also written to `output` if given.
+    """
+    options = dict(
+        scale=scale,
+        image_format=image_format,
+        quality=quality,
+        fast_png=fast_png,
+        quantize=quantize,
+    )
+
+    def render():
+        if use_daemon:
+            from snatch import daemon
+
+            try:
+                return daemon.request(html, path=socket_path, **options), []
+            except daemon.DaemonUnavailable:
+                daemon.spawn(gpu=gpu, path=socket_path)
+        return _render_in_process(html, gpu=gpu, **options), []
+
+    path = None
+    if use_cache:
+        # The HTML already carries the code, theme, fonts and layout
+        # options, so it, Chromium and the capture options cover every input
+        digest = hashlib.sha256(_browser_version().encode())
+        digest.update(html.encode())
+        path = _cache_path(digest, image_format, options)
+    return _cached_render(path, output, render)
+
+
+def render_snippet(
+    snippet,
+    output=None,
+    scale=2,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+    use_daemon=True,
+    gpu=False,
+    use_cache=True,
+    socket_path=None,
+):
+    """Highlight and render a snippet, preferring a warm background daemon
+
+    `snippet` holds build_html() keyword arguments, at least `code`. A
+    running daemon does the highlighting with its warm caches, so the
+    caller only pays for Pygments when it has to render in-process.
+    Otherwise behaves like render_html().
+    """
+    options = dict(
+        scale=scale,
+        image_format=image_format,
+        quality=quality,
+        fast_png=fast_png,
+        quantize=quantize,
+    )
+
+    def render():
+        warnings = []
+
+        def warn(message):
+            warnings.append(message)
+            _warn(message)
+
+        if use_daemon:
+            from snatch import daemon
+
+            try:
+                data = daemon.request_snippet(
+                    snippet, path=socket_path, warn=warn, **options
+                )
+                return data, warnings
+            except daemon.DaemonUnavailable:
+                daemon.spawn(gpu=gpu, path=socket_path)
+        html = build_html(warn=warn, **snippet)
+        return _render_in_process(html, gpu=gpu, **options), warnings
+
+    path = None
+    if use_cache:
+        digest = hashlib.sha256(_render_version().encode())
+        digest.update(json.dumps(snippet, sort_keys=True).encode())
+        path = _cache_path(digest, image_format, options)
+    return _cached_render(path, output, render)
+
+
+async def create_code_image(
+    code,
+    style="monokai",
+    font_size=14,
+    padding=40,
+    show_line_numbers=True,
+    output=None,  # Changed to None
+    show_window=True,
+    show_decorations=True,
+    language=None,
+    filename=None,
+    margin=60,
+    scale=2,
+    max_width=None,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+    fast=False,
+):
+    """Generate an image from code using Playwright (Chromium) rendering
+
+    Chromium is closed again afterwards, unless the call is made inside a
+    browser_session(), which keeps it up for the calls that follow.
+    """
+    html = build_html(
+        code,
+        style=style,
+        font_size=font_size,
+        padding=padding,
+        show_line_numbers=show_line_numbers,
+        show_window=show_window,
+        show_decorations=show_decorations,
+        language=language,
+        filename=filename,
+        margin=margin,
+        max_width=max_width,
+        fast=fast,
+    )
+
+    async with browser_session():
+        screenshot_bytes = await render_inline(
+            html,
+            output=output,
+            scale=scale,
+            image_format=image_format,
+            quality=quality,
+            fast_png=fast_png,
+            quantize=quantize,
+        )
+    if output:
+        print(f"Image saved to {output}")
 
     return screenshot_bytes
 
 
+def _run_batch(items, concurrency=50, gpu=False):
+    """Render batch items in-process, report each one and return an exit code"""
+    try:
+        results = asyncio.run(
+            _batch_then_shutdown(items, concurrency=concurrency, gpu=gpu)
+        )
+    except Exception as e:
+        print(f"Error generating images: {e}", file=sys.stderr)
+        return 1
+
+    failed = 0
+    for item, error in zip(items, results):
+        if error:
+            print(f"Error generating {item['output']}: {error}", file=sys.stderr)
+            failed += 1
+        else:
+            print(f"Image saved to {item['output']}")
+    return 1 if failed else 0
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Generate presentable images of code snippets",
@@ -560,6 +1507,12 @@ Examples:
   # No line numbers or window chrome
   snatch -f code.py --no-line-numbers --no-chrome -o code.png
   
+  # Render several files concurrently into shots/ (shots/a.png, shots/b.png)
+  snatch -f a.py b.py -o shots/
+  
+  # Render a manifest of snippets in one browser session
+  snatch --batch snippets.jsonl -t dracula
+
   # List all available themes
   snatch --list-themes
 
@@ -572,9 +1525,19 @@ Installation:
         """,
     )
 
-    parser.add_argument("-f", "--file", help="Input file (if not using stdin)")
     parser.add_argument(
-        "-o", "--output", help="Output file (optional, saves to file if specified)"
+        "-f",
+        "--file",
+        nargs="+",
+        action="extend",
+        help="Input file(s) (if not using stdin). Several files render "
+        "concurrently, each to <name>.png in the -o directory (default: .)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output file (optional, saves to file if specified), or the "
+        "output directory when given several files",
     )
     parser.add_argument(
         "-l",
@@ -609,6 +1572,45 @@ Installation:
         default=40,
         help="Margin around window in pixels (default: 40)",
     )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        choices=[1, 2, 3],
+        default=2,
+        help="Pixel density (default: 2). 3 is sharper but rasterizes 2.25x the "
+        "pixels of 2; 1 is fastest",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["png", "jpeg"],
+        help="Image format (default: from the output extension, else png). "
+        "jpeg encodes several times faster than png",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        help="JPEG quality from 0 to 100 (default: Chromium's)",
+    )
+    parser.add_argument(
+        "--fast-png",
+        action="store_true",
+        help="Encode PNGs via a quick lossy WebP capture and Pillow (needs Pillow)",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Shrink PNGs to an 8-bit palette (needs pngquant or Pillow)",
+    )
+    parser.add_argument(
+        "--max-width",
+        type=int,
+        help="Cap the image width in pixels, clipping long lines (e.g. for thumbnails)",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Flat background and shadow, much cheaper to paint at high --scale",
+    )
     parser.add_argument(
         "-c",
         "--clipboard",
@@ -622,9 +1624,55 @@ Installation:
     parser.add_argument(
         "--no-decorations", action="store_true", help="Hide window deocrations"
     )
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="Render every snippet in a JSON/JSONL manifest ('-' for stdin)",
+    )
+    parser.add_argument(
+        "--gpu",
+        action="store_true",
+        help="Use GPU compositing in Chromium (faster paint, more memory)",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Render in-process instead of through the background daemon",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run the render daemon in the foreground until interrupted",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Daemon socket path, for --serve and for rendering "
+        "(default: $XDG_RUNTIME_DIR/snatch.sock)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always render, bypassing the cache of previous images "
+        "(~/.cache/snatch)",
+    )
 
     args = parser.parse_args()
 
+    if args.fast_png and not has_pillow():
+        print(
+            "Warning: --fast-png needs Pillow (pip install pillow), ignoring it",
+            file=sys.stderr,
+        )
+        args.fast_png = False
+
+    if args.quantize and not can_quantize():
+        print(
+            "Warning: --quantize needs pngquant or Pillow (pip install pillow), "
+            "ignoring it",
+            file=sys.stderr,
+        )
+        args.quantize = False
+
     # Handle --list-styles
     if args.list_themes:
         print("Available Pygments styles:")
@@ -635,8 +1683,108 @@ Installation:
         print("Usage: snatch -t <theme> -f <file> [-o <output> | -c]")
         sys.exit(0)
 
+    if args.serve:
+        from snatch import daemon
+
+        if not daemon.is_supported():
+            print("Error: --serve needs UNIX sockets (Linux, macOS)", file=sys.stderr)
+            sys.exit(1)
+        try:
+            asyncio.run(
+                daemon.serve(path=args.socket, idle_timeout=None, gpu=args.gpu)
+            )
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    # Handle --batch, with the command line flags as per-item defaults
+    if args.batch:
+        try:
+            items = load_manifest(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not read manifest '{args.batch}': {e}", file=sys.stderr)
+            sys.exit(1)
+
+        defaults = dict(
+            style=args.theme,
+            font_size=args.font_size,
+            padding=args.padding,
+            margin=args.margin,
+            show_line_numbers=not args.no_line_numbers,
+            show_window=not args.no_chrome,
+            show_decorations=not args.no_decorations,
+            language=args.language,
+            max_width=args.max_width,
+            fast=args.fast,
+            scale=args.scale,
+            format=args.format,
+            quality=args.quality,
+            fast_png=args.fast_png,
+            quantize=args.quantize,
+        )
+        items = [{**defaults, **item} for item in items]
+        sys.exit(_run_batch(items, gpu=args.gpu))
+
+    # Handle several -f files as an ad-hoc batch, one image per file
+    if args.file and len(args.file) > 1:
+        if args.clipboard:
+            print("Error: -c needs a single input file", file=sys.stderr)
+            sys.exit(1)
+
+        out_dir = args.output or "."
+        if not os.path.isdir(out_dir):
+            print(f"Error: Output directory '{out_dir}' not found", file=sys.stderr)
+            sys.exit(1)
+        extension = ".jpg" if args.format == "jpeg" else ".png"
+
+        items = []
+        for path in args.file:
+            try:
+                with open(path, "r") as f:
+                    code = f.read()
+            except FileNotFoundError:
+                print(f"Error: File '{path}' not found", file=sys.stderr)
+                sys.exit(1)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            items.append(
+                dict(
+                    code=code,
+                    filename=path,
+                    output=os.path.join(out_dir, stem + extension),
+                    style=args.theme,
+                    font_size=args.font_size,
+                    padding=args.padding,
+                    margin=args.margin,
+                    show_line_numbers=not args.no_line_numbers,
+                    show_window=not args.no_chrome,
+                    show_decorations=not args.no_decorations,
+                    language=args.language,
+                    max_width=args.max_width,
+                    fast=args.fast,
+                    scale=args.scale,
+                    format=args.format,
+                    quality=args.quality,
+                    fast_png=args.fast_png,
+                    quantize=args.quantize,
+                )
+            )
+
+        outputs = [item["output"] for item in items]
+        if len(set(outputs)) < len(outputs):
+            print(
+                "Error: Input files share a name, so their images would collide",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+        sys.exit(_run_batch(items, concurrency=os.cpu_count() or 1, gpu=args.gpu))
+
     # Read code from file or stdin
     if args.file:
+        args.file = args.file[0]
         try:
             with open(args.file, "r") as f:
                 code = f.read()
@@ -651,9 +1799,12 @@ Installation:
             )
             print("Try 'snatch --help' for more information.", file=sys.stderr)
             sys.exit(1)
-        code = sys.stdin.read()
+        # Decode the raw bytes once rather than going through the text
+        # layer's incremental decoder
+        code = sys.stdin.buffer.read().decode("utf-8", errors="replace")
 
-    if not code.strip():
+    # isspace() answers without building a stripped copy of the input
+    if not code or code.isspace():
         print("Error: Input is empty", file=sys.stderr)
         sys.exit(1)
 
@@ -665,27 +1816,43 @@ Installation:
         )
         sys.exit(1)
 
+    image_format = args.format or image_format_for(args.output)
+
     # Generate image
     try:
-        screenshot_bytes = asyncio.run(
-            create_code_image(
-                code=code,
-                style=args.theme,
-                font_size=args.font_size,
-                padding=args.padding,
-                margin=args.margin,
-                show_line_numbers=not args.no_line_numbers,
-                output=args.output,  # Will be None if not specified
-                show_window=not args.no_chrome,
-                show_decorations=not args.no_decorations,
-                language=args.language,
-                filename=args.file,
-            )
+        snippet = dict(
+            code=code,
+            style=args.theme,
+            font_size=args.font_size,
+            padding=args.padding,
+            margin=args.margin,
+            show_line_numbers=not args.no_line_numbers,
+            show_window=not args.no_chrome,
+            show_decorations=not args.no_decorations,
+            language=args.language,
+            filename=args.file,
+            max_width=args.max_width,
+            fast=args.fast,
+        )
+        screenshot_bytes = render_snippet(
+            snippet,
+            output=args.output,
+            scale=args.scale,
+            image_format=image_format,
+            quality=args.quality,
+            fast_png=args.fast_png,
+            quantize=args.quantize,
+            use_daemon=not args.no_daemon,
+            gpu=args.gpu,
+            use_cache=not args.no_cache,
+            socket_path=args.socket,
         )
+        if args.output:
+            print(f"Image saved to {args.output}")
+
         # Copy to clipboard if requested
         if args.clipboard:
-            image_data = screenshot_bytes if screenshot_bytes else args.output
-            if copy_to_clipboard(image_data):
+            if copy_to_clipboard(screenshot_bytes, image_format=image_format):
                 print("Image copied to clipboard")
             else:
                 print(
@@ -0,0 +1,456 @@
+"""
+snatch daemon - keep one Chromium resident between renders
+
+Launching Chromium dominates the wall time of a single snatch invocation.
+The daemon launches it once and serves render requests over a UNIX socket,
+so only the first invocation pays the startup cost.
+
+Protocol: the client sends one JSON line of capture() arguments
+{"html", "output", "scale", "format", "quality", "fast_png", "quantize"}
+and receives one JSON line {"ok": true, "data": <base64 or null>} or
+{"ok": false, "error": <message>}. Instead of "html", a client may send
+"snippet", an object of build_html() arguments ({"code", "style", ...}),
+and leave highlighting to the daemon; such a client never has to import
+Pygments' lexers at all. The reply to a snippet also carries "warnings",
+a list of build_html()'s fallback messages. This is what the snatch CLI
+sends.
+
+`snatch --serve` runs the daemon in the foreground without the idle exit.
+"""
+
+import sys
+import os
+import json
+import argparse
+import base64
+import stat
+import socket
+import asyncio
+import tempfile
+import subprocess
+
+# Exit after this many seconds without a request
+IDLE_TIMEOUT = 300
+
+WARMUP_SNIPPET = 'def snatch():\n    return "warm"\n'
+
+# Upper bound on a single request line (the HTML embeds the fonts)
+MAX_FRAME = 64 * 1024 * 1024
+
+# How long a client waits to connect before rendering in-process instead
+CLIENT_TIMEOUT = 30
+
+# How long a client waits for the reply once the daemon has the request;
+# the first request may wait for Chromium to start, and a huge file takes
+# a while to highlight and capture
+REPLY_TIMEOUT = 600
+
+
+class DaemonUnavailable(Exception):
+    """Raised when no daemon is listening on the socket"""
+
+
+def is_supported():
+    """Whether this platform can run the daemon (UNIX sockets, POSIX users)"""
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "getuid")
+
+
+def _fallback_dir():
+    # Without os.getuid the daemon is unsupported; the name is only shown
+    name = f"snatch-{os.getuid()}" if hasattr(os, "getuid") else "snatch"
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def socket_path():
+    """Per-user socket location, preferring $XDG_RUNTIME_DIR
+
+    Without it, the socket lives in a private (0700) directory under the
+    shared temp dir, so no other user can plant or reach it.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "snatch.sock")
+    return os.path.join(_fallback_dir(), "snatch.sock")
+
+
+def _is_private_dir(directory):
+    """A real directory of ours that nobody else can get into"""
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and not st.st_mode & 0o077
+    )
+
+
+def _check_socket(path):
+    """Raise DaemonUnavailable unless `path` is safe to talk to
+
+    Anyone can bind a socket in a shared directory; only ever connect to
+    (or remove) one that belongs to this user.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError as e:
+        raise DaemonUnavailable(str(e))
+    if st.st_uid != os.getuid():
+        raise DaemonUnavailable(f"{path} belongs to another user")
+    directory = os.path.dirname(path)
+    if directory == _fallback_dir() and not _is_private_dir(directory):
+        raise DaemonUnavailable(f"{directory} is not a private directory")
+
+
+def _recv_line(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    return b"".join(chunks)
+
+
+def request(
+    html,
+    output=None,
+    scale=2,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+    path=None,
+):
+    """Render HTML through a running daemon
+
+    Returns the image bytes when no output path is given, otherwise None.
+    Raises DaemonUnavailable if nothing is listening on the socket.
+    """
+    return _exchange(
+        {"html": html},
+        output=output,
+        scale=scale,
+        image_format=image_format,
+        quality=quality,
+        fast_png=fast_png,
+        quantize=quantize,
+        path=path,
+    )
+
+
+def request_snippet(
+    snippet,
+    output=None,
+    scale=2,
+    image_format="png",
+    quality=None,
+    fast_png=False,
+    quantize=False,
+    path=None,
+    warn=None,
+):
+    """Have a running daemon highlight and render a snippet
+
+    `snippet` holds build_html() keyword arguments, at least `code`.
+    build_html()'s fallback messages are passed to `warn`, printed by
+    default. Otherwise behaves like request().
+    """
+    return _exchange(
+        {"snippet": snippet},
+        output=output,
+        scale=scale,
+        image_format=image_format,
+        quality=quality,
+        fast_png=fast_png,
+        quantize=quantize,
+        path=path,
+        warn=warn,
+    )
+
+
+def _warn(message):
+    print(f"Warning: {message}", file=sys.stderr)
+
+
+def _exchange(
+    frame, output, scale, image_format, quality, fast_png, quantize, path, warn=None
+):
+    if not is_supported():
+        raise DaemonUnavailable("the daemon is not supported on this platform")
+    path = path or socket_path()
+    _check_socket(path)
+    frame.update(
+        {
+            "output": os.path.abspath(output) if output else None,
+            "scale": scale,
+            "format": image_format,
+            "quality": quality,
+            "fast_png": fast_png,
+            "quantize": quantize,
+        }
+    )
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except OSError as e:
+        raise DaemonUnavailable(str(e))
+
+    with sock:
+        # A stalled daemon must not hang the client (socket.timeout is an
+        # OSError too)
+        sock.settimeout(CLIENT_TIMEOUT)
+        try:
+            sock.connect(path)
+            sock.sendall(json.dumps(frame).encode() + b"\n")
+        except OSError as e:
+            raise DaemonUnavailable(str(e))
+        # The daemon is working on it now. Rendering in-process (and spawning
+        # another daemon) on a slow reply would only do the work twice.
+        sock.settimeout(REPLY_TIMEOUT)
+        try:
+            line = _recv_line(sock)
+        except socket.timeout:
+            raise RuntimeError(f"daemon did not reply within {REPLY_TIMEOUT}s")
+        except OSError as e:
+            raise DaemonUnavailable(str(e))
+
+    if not line:
+        raise DaemonUnavailable("daemon closed the connection")
+    reply = json.loads(line)
+    for message in reply.get("warnings", ()):
+        (warn or _warn)(message)
+    if not reply["ok"]:
+        raise RuntimeError(reply["error"])
+    return base64.b64decode(reply["data"]) if reply["data"] else None
+
+
+def spawn(gpu=False, path=None):
+    """Start a detached daemon in the background, where supported"""
+    if not is_supported():
+        return
+    command = [sys.executable, "-m", "snatch.daemon"]
+    if gpu:
+        command.append("--gpu")
+    if path:
+        command += ["--socket", path]
+    try:
+        subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as e:
+        print(f"Warning: Could not start snatch daemon: {e}", file=sys.stderr)
+
+
+def _is_listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+async def _respond(writer, reply):
+    try:
+        writer.write(json.dumps(reply).encode() + b"\n")
+        await writer.drain()
+    except ConnectionError:
+        # The client hung up (timed out, interrupted); nobody to tell
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(path=None, idle_timeout=IDLE_TIMEOUT, gpu=False):
+    """Launch Chromium once and serve render requests until idle
+
+    With `idle_timeout` None, serve until cancelled.
+    """
+    # POSIX-only, like the daemon itself
+    import fcntl
+
+    from snatch import build_html, capture, get_pool, shutdown
+
+    path = path or socket_path()
+    directory = os.path.dirname(path)
+    if directory == _fallback_dir():
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        if not _is_private_dir(directory):
+            print(
+                f"Error: {directory} is not a private directory, not serving",
+                file=sys.stderr,
+            )
+            return
+
+    loop = asyncio.get_running_loop()
+    last_active = loop.time()
+    ready = asyncio.Event()
+    launch_error = None
+
+    async def handle(reader, writer):
+        nonlocal last_active
+        try:
+            line = await reader.readline()
+        except ConnectionError:
+            line = b""
+        except ValueError as e:
+            # Longer than MAX_FRAME
+            await _respond(writer, {"ok": False, "error": str(e)})
+            return
+        if not line:
+            # A liveness probe (or a client that gave up); not activity
+            writer.close()
+            return
+        last_active = loop.time()
+        try:
+            frame = json.loads(line)
+            warnings = []
+            if "html" in frame:
+                html = frame["html"]
+            else:
+                # Highlighting is CPU-bound; keep the loop free for captures
+                html = await asyncio.to_thread(
+                    build_html, warn=warnings.append, **frame["snippet"]
+                )
+            # Connections accepted while Chromium starts wait for it
+            await ready.wait()
+            if launch_error:
+                raise RuntimeError(f"Chromium failed to launch: {launch_error}")
+            # Fetched per request: if Chromium crashed, this relaunches it
+            pool = await get_pool(gpu=gpu)
+            data = await capture(
+                pool,
+                html,
+                output=frame["output"],
+                scale=frame["scale"],
+                image_format=frame.get("format", "png"),
+                quality=frame.get("quality"),
+                fast_png=frame.get("fast_png", False),
+                quantize=frame.get("quantize", False),
+            )
+            # Clients that gave an output path read the image from there
+            reply = {
+                "ok": True,
+                "data": None if frame["output"] else base64.b64encode(data).decode(),
+                "warnings": warnings,
+            }
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        finally:
+            last_active = loop.time()
+        await _respond(writer, reply)
+
+    # Two daemons spawned at once would both find no live socket, and the
+    # second bind would replace the first's socket file; take turns
+    lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        await asyncio.to_thread(fcntl.flock, lock_fd, fcntl.LOCK_EX)
+        if os.path.lexists(path):
+            try:
+                _check_socket(path)
+            except DaemonUnavailable as e:
+                print(f"Error: {e}, not serving", file=sys.stderr)
+                return
+            if _is_listening(path):
+                print(f"snatch daemon already running on {path}", file=sys.stderr)
+                return
+            # Stale socket left behind by a daemon that died
+            os.unlink(path)
+
+        # Listen before launching Chromium, so clients that arrive during
+        # startup queue up here instead of spawning daemons of their own
+        old_umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(
+                handle, path=path, limit=MAX_FRAME
+            )
+        finally:
+            os.umask(old_umask)
+        # Only remove the socket on exit if it is still ours
+        bound_ino = os.stat(path).st_ino
+    finally:
+        os.close(lock_fd)
+    print(f"snatch daemon serving on {path}", file=sys.stderr)
+
+    try:
+        async with server:
+            try:
+                pool = await get_pool(gpu=gpu)
+            except Exception as e:
+                # Let waiting clients fail (and fall back to rendering
+                # in-process) rather than hang; the server can only close
+                # once their handlers are done
+                launch_error = e
+                ready.set()
+                raise
+
+            # Pay for the first page, font decoding and first paint up front
+            # rather than on the first client's render. miasma has bold
+            # keywords, so both embedded faces get loaded.
+            try:
+                html = build_html(WARMUP_SNIPPET, style="miasma", language="python")
+                await capture(pool, html)
+            except Exception as e:
+                print(f"Warning: Daemon warm-up render failed: {e}", file=sys.stderr)
+
+            ready.set()
+            last_active = loop.time()
+            if idle_timeout is None:
+                await asyncio.Future()
+            while loop.time() - last_active < idle_timeout:
+                await asyncio.sleep(min(idle_timeout, 5))
+    finally:
+        try:
+            if os.stat(path).st_ino == bound_ino:
+                os.unlink(path)
+        except OSError:
+            pass
+        await shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="snatch-daemon", description="Keep a warm Chromium for snatch"
+    )
+    parser.add_argument("--gpu", action="store_true", help="Use GPU compositing")
+    parser.add_argument("--socket", help=f"Socket path (default: {socket_path()})")
+    parser.add_argument(
+        "--idle-timeout",
+        type=int,
+        default=IDLE_TIMEOUT,
+        help=f"Exit after this many idle seconds, 0 for never (default: {IDLE_TIMEOUT})",
+    )
+    args = parser.parse_args()
+
+    if not is_supported():
+        print("Error: snatch-daemon needs UNIX sockets (Linux, macOS)", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        asyncio.run(
+            serve(
+                path=args.socket,
+                idle_timeout=args.idle_timeout or None,
+                gpu=args.gpu,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()